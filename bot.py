@@ -1,14 +1,24 @@
 import os
-import telebot 
-import requests
+import json
+import codecs
+import asyncio
+import aiohttp
 import phonenumbers 
-import qrcode 
+import segno
 import logging
+import redis.asyncio as redis
 from io import BytesIO 
+from concurrent.futures import ThreadPoolExecutor
 from telebot import types  
 from dotenv import load_dotenv
+from telebot.async_telebot import AsyncTeleBot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+try:
+    import uvloop  # Faster event loop (not available on Windows)
+except ImportError:
+    uvloop = None
+
 # --- Configuration & Setup ---
 
 # 1. Configure Logging
@@ -21,91 +31,154 @@ logging.basicConfig(
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 API_URL = os.getenv("API_URL")
+REDIS_SOCKET = os.getenv("REDIS_SOCKET", "/var/run/redis/redis.sock")
 
 # 3. Check if token exists
 if not TELEGRAM_TOKEN:
     logging.error("No TELEGRAM_TOKEN found in .env file")
     exit()
 
-# 4. Initialize the bot
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
-logging.info("Bot is running...")
+# 4. Initialize the bot (async handlers, so backend I/O never blocks other users)
+bot = AsyncTeleBot(TELEGRAM_TOKEN)
+
+# 5. Shared HTTP session for backend calls (created in main(), needs a running loop)
+SESSION = None
+
+# 6. Redis session store (survives restarts, shared between bot workers)
+r = redis.Redis(unix_socket_path=REDIS_SOCKET, decode_responses=True)
+r_bin = redis.Redis(unix_socket_path=REDIS_SOCKET)  # Raw bytes (QR images)
+SESSION_TTL = 600  # Seconds a registration flow may stay idle
+
+# 7. Short-lived caches for backend responses
+EVENTS_CACHE_KEY = "events:list"
+EVENTS_CACHE_TTL = 45
+TICKETS_CACHE_TTL = 15
+QR_CACHE_TTL = 86400 * 30  # Ticket QR codes never change
+
+# QR rendering is CPU work, keep it off the event loop
+QR_POOL = ThreadPoolExecutor(max_workers=4)
+
+# 8. Minimum seconds between edits of a streamed AI answer (Telegram rate limits)
+STREAM_EDIT_INTERVAL = 0.5
+
+
+def session_key(chat_id):
+    return f"sess:{chat_id}"
 
-# Temporary dictionary to store data (In production, use Redis or DB)
-user_data = {}
+def awaiting_step(step):
+    """Builds a handler filter that matches users currently at the given registration step."""
+    async def check(message):
+        return await r.hget(session_key(message.chat.id), 'step') == step
+    return check
+
+async def fetch_cached(url, cache_key, ttl):
+    """GETs a backend JSON endpoint, serving it from Redis while the cached copy is fresh.
+    Returns (status_code, data)."""
+    cached = await r.get(cache_key)
+    if cached:
+        return 200, json.loads(cached)
+
+    async with SESSION.get(url) as response:
+        status = response.status
+        if status != 200:
+            return status, None
+        body = await response.text()
+
+    await r.setex(cache_key, ttl, body)
+    return status, json.loads(body)
+
+def build_qr_png(ticket_id, chat_id):
+    """Renders the ticket QR code and returns the PNG bytes."""
+    qr_data = f"TICKET-ID:{ticket_id} | OWNER:{chat_id}"
+
+    # make_qr: never fall back to Micro QR, which many door scanners can't read
+    bio = BytesIO()
+    segno.make_qr(qr_data, error='L').save(bio, kind='png', scale=6)
+    return bio.getvalue()
+
+async def get_qr_png(ticket_id, chat_id):
+    """Returns the ticket QR PNG, generating and caching it on the first view only."""
+    key = f"qr:{ticket_id}:{chat_id}"
+    png = await r_bin.get(key)
+    if png is None:
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(QR_POOL, build_qr_png, ticket_id, chat_id)
+        await r_bin.setex(key, QR_CACHE_TTL, png)
+    return png
 
 
 # --- Standard commands ---
 
 @bot.message_handler(commands=['start'])
-def send_welcome(message):
-    bot.reply_to(message, "Welcome to PartyFlow! 🥳\nUse /events to see upcoming parties.\nUse /my_tickets to view your tickets.")
+async def send_welcome(message):
+    await bot.reply_to(message, "Welcome to PartyFlow! 🥳\nUse /events to see upcoming parties.\nUse /my_tickets to view your tickets.")
 
 @bot.message_handler(commands=['events'])
-def list_events(message):
+async def list_events(message):
     try:
         if not API_URL:
-            bot.reply_to(message, "Error: API_URL is missing.")
+            await bot.reply_to(message, "Error: API_URL is missing.")
             return
         
-        # Fetch events from the backend
-        response = requests.get(f"{API_URL}/events")
+        # Fetch events from the backend (or the short-lived cache)
+        status, data = await fetch_cached(f"{API_URL}/events", EVENTS_CACHE_KEY, EVENTS_CACHE_TTL)
 
-        if response.status_code == 200:
-            data = response.json()
+        if status == 200:
             events = data.get('events', [])
 
             if not events:
-                bot.reply_to(message, "No upcoming parties found")
+                await bot.reply_to(message, "No upcoming parties found")
                 return
 
-            bot.send_message(message.chat.id, "🎉 **Upcoming Parties:** 👇")
+            # One message for the whole list (a single Telegram API call), one buy button per event
+            event_texts = []
+            markup = types.InlineKeyboardMarkup(row_width=1)
 
             for event in events:
-                event_text = (
+                event_texts.append(
                     f"🎈 **{event['name']}**\n"
                     f"📍 {event['location']} | 📅 {event['date']}\n"
                     f"💰 Price: {event['price']} NIS"
                 )
+                markup.add(types.InlineKeyboardButton(f"🛒 Buy {event['name']}", callback_data=f"buy_{event['id']}"))
 
-                markup = types.InlineKeyboardMarkup()
-                buy_button = types.InlineKeyboardButton("🛒 Buy Ticket", callback_data=f"buy_{event['id']}")
-                markup.add(buy_button)
-
-                bot.send_message(message.chat.id, event_text, reply_markup=markup, parse_mode="markdown")
+            text = "🎉 **Upcoming Parties:** 👇\n\n" + "\n\n".join(event_texts)
+            await bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="markdown")
 
         else:
-            bot.reply_to(message, f"Server Error: {response.status_code}")
+            await bot.reply_to(message, f"Server Error: {status}")
 
     except Exception as e:
-        bot.reply_to(message, f"Connection failed: {e}")
+        await bot.reply_to(message, f"Connection failed: {e}")
 
 
 # --- Command: View My Tickets ---
 
 @bot.message_handler(commands=['my_tickets'])
-def my_tickets(message):
+async def my_tickets(message):
     chat_id = message.chat.id
     
     try:
         if not API_URL:
-            bot.reply_to(message, "Configuration Error: API_URL missing.")
+            await bot.reply_to(message, "Configuration Error: API_URL missing.")
             return
 
-        # Request tickets from server
-        response = requests.get(f"{API_URL}/api/tickets/{chat_id}")
+        # Request tickets from server (or the short-lived cache)
+        status, data = await fetch_cached(f"{API_URL}/api/tickets/{chat_id}", f"tickets:{chat_id}", TICKETS_CACHE_TTL)
         
-        if response.status_code == 200:
-            data = response.json()
+        if status == 200:
             tickets = data.get('tickets', [])
             
             if not tickets:
-                bot.reply_to(message, "You don't have any tickets yet. Type /events to buy one! 🎟️")
+                await bot.reply_to(message, "You don't have any tickets yet. Type /events to buy one! 🎟️")
                 return
             
-            bot.send_message(chat_id, f"🎫 Found {len(tickets)} ticket(s):")
+            await bot.send_message(chat_id, f"🎫 Found {len(tickets)} ticket(s):")
             
-            for ticket in tickets:
+            # QR code images (cached by ticket), missing ones are rendered in parallel
+            pngs = await asyncio.gather(*(get_qr_png(ticket['id'], chat_id) for ticket in tickets))
+            
+            for ticket, png in zip(tickets, pngs):
                 caption = (
                     f"🎟️ **Ticket #{ticket['id']}**\n"
                     f"🎉 Event: {ticket['name']}\n" 
@@ -113,75 +186,84 @@ def my_tickets(message):
                     f"📍 Location: {ticket['location']}"
                 )
                 
-                # Generate QR Code string
-                qr_data = f"TICKET-ID:{ticket['id']} | OWNER:{chat_id}"
-                qr_img = qrcode.make(qr_data)
-                
-                # Save to memory buffer
-                bio = BytesIO()
-                qr_img.save(bio, 'PNG')
-                bio.seek(0)
-                
                 # Send photo
-                bot.send_photo(chat_id, bio, caption=caption, parse_mode="markdown")
+                await bot.send_photo(chat_id, BytesIO(png), caption=caption, parse_mode="markdown")
                 
         else:
-            bot.reply_to(message, "Error fetching tickets from server.")
+            await bot.reply_to(message, "Error fetching tickets from server.")
             
     except Exception as e:
-        bot.reply_to(message, f"Error: {e}")
+        await bot.reply_to(message, f"Error: {e}")
 
 
 # --- Smart Registration Flow ---
 
+# Quantity buttons ("qty_1".."qty_5") -> number of tickets
+QTY_MAP = {f"qty_{i}": i for i in range(1, 6)}
+
 # Step 1: User clicks "buy" -> Ask for Quantity
-@bot.callback_query_handler(func=lambda call: call.data.startswith("buy_"))
-def ask_quantity(call):
+async def ask_quantity(call):
     chat_id = call.message.chat.id
-    event_id = int(call.data.split('_')[1])
+    event_id = int(call.data[4:])  # "buy_<id>"
 
-    # Save event_id to user session
-    user_data[chat_id] = {'event_id': event_id}
+    # Start a fresh user session with the event_id
+    key = session_key(chat_id)
+    await r.pipeline().delete(key).hset(key, mapping={'event_id': event_id}).expire(key, SESSION_TTL).execute()
 
     # Create buttons for quantity selection (1 to 5)
     markup = InlineKeyboardMarkup()
     buttons = []
-    for i in range(1, 6):
-        buttons.append(InlineKeyboardButton(str(i), callback_data=f"qty_{i}"))
+    for data, i in QTY_MAP.items():
+        buttons.append(InlineKeyboardButton(str(i), callback_data=data))
     
     markup.add(*buttons)
     
-    bot.send_message(chat_id, "How many tickets would you like? 🎫", reply_markup=markup)
+    await bot.send_message(chat_id, "How many tickets would you like? 🎫", reply_markup=markup)
 
 # Step 2: User selects quantity -> Ask for Name
-@bot.callback_query_handler(func=lambda call: call.data.startswith("qty_"))
-def ask_name(call):
+async def ask_name(call):
     chat_id = call.message.chat.id
-    quantity = int(call.data.split('_')[1])
+    quantity = QTY_MAP.get(call.data)
+    if quantity is None:
+        return
     
     # Save quantity if session exists
-    if chat_id in user_data:
-        user_data[chat_id]['quantity'] = quantity
-        msg = bot.send_message(chat_id, f"Ordering {quantity} ticket(s). \nWhat is your **Full Name**?")
-        bot.register_next_step_handler(msg, ask_phone)
+    key = session_key(chat_id)
+    if await r.exists(key):
+        await r.pipeline().hset(key, mapping={'quantity': quantity, 'step': 'name'}).expire(key, SESSION_TTL).execute()
+        await bot.send_message(chat_id, f"Ordering {quantity} ticket(s). \nWhat is your **Full Name**?")
     else:
-        bot.send_message(chat_id, "Session expired. Please start over from /events.")
+        await bot.send_message(chat_id, "Session expired. Please start over from /events.")
+
+# Inline buttons are routed by their callback_data prefix ("buy_3" -> ask_quantity)
+CALLBACK_HANDLERS = {
+    'buy': ask_quantity,
+    'qty': ask_name,
+}
+
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    handler = CALLBACK_HANDLERS.get(call.data.split('_', 1)[0])
+    if handler:
+        await handler(call)
 
 # Step 3: Save name and ask for phone
-def ask_phone(message):
+@bot.message_handler(func=awaiting_step('name'))
+async def ask_phone(message):
     chat_id = message.chat.id
     name = message.text
 
     # Update user session with name
-    if chat_id in user_data:
-        user_data[chat_id]['name'] = name
-        msg = bot.send_message(chat_id, f"Nice to meet you, {name}! 👋\nNow, please enter your **Phone Number**:")
-        bot.register_next_step_handler(msg, validate_phone)
+    key = session_key(chat_id)
+    if await r.exists(key):
+        await r.pipeline().hset(key, mapping={'name': name, 'step': 'phone'}).expire(key, SESSION_TTL).execute()
+        await bot.send_message(chat_id, f"Nice to meet you, {name}! 👋\nNow, please enter your **Phone Number**:")
     else:
-        bot.send_message(chat_id, "Session expired. Please start over.")
+        await bot.send_message(chat_id, "Session expired. Please start over.")
 
-# Step 4: Validate the phone number
-def validate_phone(message):
+# Step 4: Validate the phone number (the session stays at the 'phone' step until it is valid)
+@bot.message_handler(func=awaiting_step('phone'))
+async def validate_phone(message):
     chat_id = message.chat.id
     phone_input = message.text
     
@@ -191,69 +273,71 @@ def validate_phone(message):
         
         # 2. Check if valid
         if not phonenumbers.is_valid_number(parsed_number):
-            msg = bot.send_message(chat_id, "❌ Invalid number. Please try again (e.g., 0501234567):")
-            bot.register_next_step_handler(msg, validate_phone) 
+            await bot.send_message(chat_id, "❌ Invalid number. Please try again (e.g., 0501234567):")
             return
 
         # 3. Format nicely (E.164 standard)
         formatted_phone = phonenumbers.format_number(parsed_number, phonenumbers.PhoneNumberFormat.E164)
         
         # Save valid phone and proceed to payment
-        finalize_order(message, formatted_phone)
+        await finalize_order(message, formatted_phone)
 
     except phonenumbers.NumberParseException:
-        msg = bot.send_message(chat_id, "❌ That doesn't look like a phone number. Try again:")
-        bot.register_next_step_handler(msg, validate_phone)
+        await bot.send_message(chat_id, "❌ That doesn't look like a phone number. Try again:")
 
 # Step 5: Finalize purchase with server
-def finalize_order(message, valid_phone):
+async def finalize_order(message, valid_phone):
     chat_id = message.chat.id
     
-    current_user = user_data.get(chat_id)
+    current_user = await r.hgetall(session_key(chat_id))
     if not current_user:
-        bot.send_message(chat_id, "Session expired. Please use /start again.")
+        await bot.send_message(chat_id, "Session expired. Please use /start again.")
         return
 
     # Prepare payload with quantity
     payload = {
-        "event_id": current_user['event_id'],
+        "event_id": int(current_user['event_id']),
         "user_name": current_user['name'],
         "user_id": chat_id,
         "phone_number": valid_phone,
-        "quantity": current_user.get('quantity', 1)  # Default to 1 if missing
+        "quantity": int(current_user.get('quantity', 1))  # Default to 1 if missing
     }
     
-    bot.send_message(chat_id, "Generating payment link... 💳")
+    await bot.send_message(chat_id, "Generating payment link... 💳")
     
     try:
         # Send order to backend
-        response = requests.post(f"{API_URL}/create_checkout_session", json=payload)
+        async with SESSION.post(f"{API_URL}/create_checkout_session", json=payload) as response:
+            status = response.status
+            data = await response.json() if status == 200 else None
         
-        if response.status_code == 200:
-            data = response.json()
+        if status == 200:
             payment_url = data.get('checkout_url')
+
+            # Availability is about to change, drop the cached event list
+            await r.delete(EVENTS_CACHE_KEY)
             
             markup = InlineKeyboardMarkup()
             markup.add(InlineKeyboardButton("👉 Click to Pay Now 👈", url=payment_url))
             
-            bot.send_message(chat_id, "Ticket reserved! Please complete payment:", reply_markup=markup)
+            await bot.send_message(chat_id, "Ticket reserved! Please complete payment:", reply_markup=markup)
             
-        elif response.status_code == 400:
-            bot.send_message(chat_id, "⚠️ Sorry, not enough tickets left for this request!")
+        elif status == 400:
+            await bot.send_message(chat_id, "⚠️ Sorry, not enough tickets left for this request!")
         else:
-            bot.send_message(chat_id, "❌ Error generating payment link.")
+            await bot.send_message(chat_id, "❌ Error generating payment link.")
             
     except Exception as e:
-        bot.send_message(chat_id, f"Connection Error: {e}")
+        await bot.send_message(chat_id, f"Connection Error: {e}")
     
     # Clear session data
-    user_data.pop(chat_id, None)
+    await r.delete(session_key(chat_id))
 
 
 # --- AI Chat Handler (Added) ---
 
 @bot.message_handler(func=lambda message: True)
-def handle_all_messages(message):
+async def handle_all_messages(message):
     # Ignore commands starting with /
     if message.text.startswith('/'):
         return
@@ -262,20 +346,66 @@ def handle_all_messages(message):
     chat_id = message.chat.id
 
     # Visual indicator that the bot is typing/thinking
-    bot.send_chat_action(chat_id, 'typing')
+    await bot.send_chat_action(chat_id, 'typing')
 
     try:
-        # Send question to our backend API
-        response = requests.post(f"{API_URL}/api/ask", json={"user_question": user_text})
-        
-        if response.status_code == 200:
-            answer = response.json().get("answer", "Error")
-            bot.reply_to(message, answer)
-        else:
-            bot.reply_to(message, "Oops, the server is unavailable right now. 😓")
+        # Send question to our backend API and show the answer while it is being written
+        async with SESSION.post(f"{API_URL}/api/ask/stream", json={"user_question": user_text}) as response:
+            if response.status != 200:
+                await bot.reply_to(message, "Oops, the server is unavailable right now. 😓")
+                return
+
+            loop = asyncio.get_running_loop()
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            answer = ""
+            shown = ""
+            reply = None
+            last_edit = 0
+
+            async for chunk in response.content.iter_any():
+                answer += decoder.decode(chunk)
+                if not answer.strip():
+                    continue
+
+                # First text -> one reply, then throttled edits of that same message
+                if reply is None:
+                    reply = await bot.reply_to(message, answer)
+                    shown = answer
+                    last_edit = loop.time()
+                elif loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+                    await bot.edit_message_text(answer, chat_id, reply.message_id)
+                    shown = answer
+                    last_edit = loop.time()
+
+            answer += decoder.decode(b"", final=True)
+
+        if reply is None:
+            await bot.reply_to(message, answer.strip() or "Error")
+        elif answer != shown:
+            await bot.edit_message_text(answer, chat_id, reply.message_id)
 
     except Exception as e:
-        bot.reply_to(message, "Communication error. Please try again.")
+        await bot.reply_to(message, "Communication error. Please try again.")
+
 
 # 6. Start the bot
-bot.infinity_polling()
\ No newline at end of file
+async def main():
+    global SESSION
+    SESSION = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=30),
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+    # Load the IL phone metadata now instead of on the first user's purchase
+    phonenumbers.parse("0501234567", "IL")
+    logging.info("Bot is running...")
+    try:
+        await bot.infinity_polling()
+    finally:
+        await SESSION.close()
+        await r.aclose()
+        await r_bin.aclose()
+        await bot.close_session()
+        QR_POOL.shutdown()
+
+if __name__ == "__main__":
+    (uvloop.run if uvloop else asyncio.run)(main())
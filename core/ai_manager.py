@@ -1,5 +1,7 @@
 import os
 import json
+import redis
+import hashlib
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -9,12 +11,44 @@ load_dotenv()
 # Configure the API
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+# Shared model instance (using 'gemini-2.5-flash' for speed and stability)
+_MODEL = genai.GenerativeModel('gemini-2.5-flash')
+
+# Redis cache for AI answers (identical prompts get the stored reply)
+_cache = redis.Redis(
+    unix_socket_path=os.getenv("REDIS_SOCKET", "/var/run/redis/redis.sock"),
+    decode_responses=True
+)
+AI_CACHE_TTL = 600  # Seconds
+
+def _cache_key(prefix, *parts):
+    digest = hashlib.blake2b("\x1f".join(map(str, parts)).encode(), digest_size=16).hexdigest()
+    return f"ai:{prefix}:{digest}"
+
+def _cache_get(key):
+    # The cache is best-effort: if Redis is down we simply call Gemini
+    try:
+        return _cache.get(key)
+    except redis.RedisError as e:
+        print(f"Cache Error: {e}")
+        return None
+
+def _cache_set(key, value):
+    try:
+        _cache.setex(key, AI_CACHE_TTL, value)
+    except redis.RedisError as e:
+        print(f"Cache Error: {e}")
+
 def generate_party_promo(event_name, location, date, vibe="energetic"):
     """
     Generates a short, hype-filled promotional message for Telegram using Gemini AI.
     """
-    # Using 'gemini-2.5-flash' for speed and stability
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    cache_key = _cache_key("promo", event_name, location, date, vibe)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
+
+    model = _MODEL
     
     prompt = (
         f"Write a short, hype-filled promotional message for a party named '{event_name}' "
@@ -25,53 +59,99 @@ def generate_party_promo(event_name, location, date, vibe="energetic"):
     
     try:
         response = model.generate_content(prompt)
+        _cache_set(cache_key, response.text)
         return response.text
     except Exception as e:
         # Print error to console for debugging
         print(f"Gemini Error: {e}")
         return f"Error generating text. Please check server logs."
 
-def answer_user_question(user_question, events_context):
-    """
-    Answers a user question based on the list of active events.
-    """
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
+def _answer_prompt(user_question, events_context):
     # Construct a prompt with the event context and the user's question
-    prompt = (
+    return (
         f"You are a helpful support agent for a party ticket bot called 'PartyFlow'.\n"
         f"Here is the current list of active events:\n{events_context}\n\n"
         f"User Question: {user_question}\n"
         f"Answer the user politely and briefly in the same language they asked (Hebrew/English). "
         f"If the answer is not in the event list, say you don't know."
     )
+
+def answer_user_question(user_question, events_context):
+    """
+    Answers a user question based on the list of active events.
+    """
+    cache_key = _cache_key("ans", user_question, events_context)
+    cached = _cache_get(cache_key)
+    if cached:
+        return cached
+
+    model = _MODEL
+    prompt = _answer_prompt(user_question, events_context)
     
     try:
         response = model.generate_content(prompt)
+        _cache_set(cache_key, response.text)
         return response.text
     except Exception as e:
         print(f"Gemini Chat Error: {e}")
         return "Sorry, I am having trouble answering right now. Please try again later."
 
+def stream_user_answer(user_question, events_context):
+    """
+    Streaming version of answer_user_question.
+    Yields text chunks as Gemini produces them, so the reply can be shown before it is complete.
+    """
+    cache_key = _cache_key("ans", user_question, events_context)
+    cached = _cache_get(cache_key)
+    if cached:
+        yield cached
+        return
+
+    prompt = _answer_prompt(user_question, events_context)
+    answer = ""
+    
+    try:
+        for chunk in _MODEL.generate_content(prompt, stream=True):
+            answer += chunk.text
+            yield chunk.text
+        _cache_set(cache_key, answer)
+    except Exception as e:
+        print(f"Gemini Chat Error: {e}")
+        yield "Sorry, I am having trouble answering right now. Please try again later."
+
+# Structured output format for parse_event_details
+EVENT_DETAILS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "date": {"type": "string"},
+        "location": {"type": "string"},
+        "price": {"type": "number"},
+        "total_tickets": {"type": "integer"}
+    },
+    "required": ["name", "date", "location", "price", "total_tickets"]
+}
+
 def parse_event_details(raw_text):
 # Analyzes raw text (e.g., from WhatsApp/Facebook) and extracts event details into a JSON format.
 # Returns a dictionary with keys: name, date, location, price, total_tickets.
-    model = genai.GenerativeModel('gemini-2.5-flash')
-# Instruct the AI to return ONLY raw JSON without markdown formatting
+    model = _MODEL
+# The response schema makes Gemini return plain JSON, so no formatting instructions are needed
     prompt = (
         f"Analyze the following event text and extract: Name, Date (YYYY-MM-DD), "
-        f"Location, Price (number only), and Total Tickets (estimate or default 100). "
-        f"Return ONLY a raw JSON object. Do not use Markdown formatting (no ```json blocks). "
-        f"Fields: name, date, location, price, total_tickets.\n\n"
+        f"Location, Price (number only), and Total Tickets (estimate or default 100).\n\n"
         f"Raw Text:\n{raw_text}"
     )
     
     try:
-        response = model.generate_content(prompt)
-        # Clean up text in case AI added markdown code blocks despite instructions
-        clean_text = response.text.replace('```json', '').replace('```', '').strip()
-        
-        return json.loads(clean_text)
+        response = model.generate_content(
+            prompt,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": EVENT_DETAILS_SCHEMA
+            }
+        )
+        return json.loads(response.text)
     except Exception as e:
         print(f"Parsing Error: {e}")
         return None
\ No newline at end of file
@@ -1,15 +1,76 @@
 import sqlite3
+import threading
+import functools
+import time
 import os
 
 # Path to the database file
 DB_NAME = os.path.join("database", "party_bot.db")
 
+# One long-lived connection per thread (sqlite3 connections are not thread-safe)
+_tls = threading.local()
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection (sqlite3 default is 128)
+_all_conns = []  # Every opened connection, so they can be closed cleanly on shutdown
+_all_conns_lock = threading.Lock()
+_generation = 0  # Bumped by close_connections(); a thread holding an older connection reopens it
+
+def _conn():
+    """Returns this thread's database connection, opening and tuning it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None or getattr(_tls, "generation", None) != _generation:
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        # WAL lets dashboard reads run while a ticket purchase is being written
+        conn.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA mmap_size=268435456;"
+            "PRAGMA cache_size=-65536;"
+        )
+        _tls.conn = conn
+        with _all_conns_lock:
+            _all_conns.append(conn)
+            _tls.generation = _generation
+    return conn
+
+def close_connections():
+    """Refreshes query planner statistics and closes every open connection (call on shutdown)."""
+    global _generation
+    with _all_conns_lock:
+        _generation += 1
+        for conn in _all_conns:
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Database Error: {e}")
+        _all_conns.clear()
+
+# Dashboard aggregates are cached briefly and dropped whenever tickets/events change
+STATS_CACHE_TTL = 30  # Seconds
+_stats_cache = {}
+
+def _cached_stat(func):
+    @functools.wraps(func)
+    def wrapper():
+        hit = _stats_cache.get(func.__name__)
+        if hit and hit[1] > time.monotonic():
+            return hit[0]
+        value = func()
+        _stats_cache[func.__name__] = (value, time.monotonic() + STATS_CACHE_TTL)
+        return value
+    return wrapper
+
+def _invalidate_stats():
+    _stats_cache.clear()
+
 # --- Existing Functions ---
 
 def create_tables():
     """Creates the necessary tables if they don't exist."""
     os.makedirs("database", exist_ok=True)
-    conn = sqlite3.connect(DB_NAME)
+    conn = _conn()
     cursor = conn.cursor()
     
     # Create Events table
@@ -38,110 +99,144 @@ def create_tables():
         )
     ''')
     
+    # Stripe checkout sessions that already produced tickets (webhooks can be delivered more than once)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            stripe_session_id TEXT PRIMARY KEY, 
+            processed_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Indexes for the per-event / per-user ticket lookups and the active events list.
+    # (event_id, user_id) also covers the per-event counts, so a lone event_id index is redundant.
+    cursor.executescript('''
+        DROP INDEX IF EXISTS idx_tickets_event;
+        CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id);
+        CREATE INDEX IF NOT EXISTS idx_tickets_event_user ON tickets(event_id, user_id);
+        CREATE INDEX IF NOT EXISTS idx_events_active_date ON events(is_active, date);
+    ''')
+    
     conn.commit()
-    conn.close()
 
 def add_ticket(event_id, user_id, user_name, phone_number):
     """Adds a new ticket to the database."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO tickets (event_id, user_id, user_name, phone_number) 
-            VALUES (?, ?, ?, ?)
-        ''', (event_id, user_id, user_name, phone_number))
+        conn = _conn()
+        with conn:  # Commits on success, rolls back on error
+            cursor = conn.execute('''
+                INSERT INTO tickets (event_id, user_id, user_name, phone_number) 
+                VALUES (?, ?, ?, ?)
+            ''', (event_id, user_id, user_name, phone_number))
+        _invalidate_stats()
         
-        conn.commit()
         last_row_id = cursor.lastrowid # Returns the ID of the created ticket
-        conn.close()
         return last_row_id
     except Exception as e:
         print(f"Database Error: {e}")
         return False
 
+def add_tickets_bulk(rows, payment_id=None):
+    """
+    Adds several tickets in one transaction (one commit for the whole order).
+    rows: list of (event_id, user_id, user_name, phone_number) tuples.
+    payment_id: optional Stripe session ID; an already-processed payment adds nothing and returns [].
+    Returns the IDs of the created tickets, in insert order.
+    """
+    try:
+        conn = _conn()
+        with conn:
+            if payment_id is not None:
+                marked = conn.execute("INSERT OR IGNORE INTO payments (stripe_session_id) VALUES (?)", (payment_id,))
+                if marked.rowcount == 0:
+                    return []
+            cursor = conn.executemany('''
+                INSERT INTO tickets (event_id, user_id, user_name, phone_number) 
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+            last_row_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        _invalidate_stats()
+        # The transaction holds the write lock, so the new IDs are consecutive
+        # (executemany can't use RETURNING)
+        return list(range(last_row_id - cursor.rowcount + 1, last_row_id + 1))
+    except Exception as e:
+        print(f"Database Error: {e}")
+        return False
+
 def get_events():
     """Fetches all ACTIVE events."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = _conn()
     cursor = conn.cursor()
     # Filter by is_active = 1
     cursor.execute("SELECT * FROM events WHERE is_active = 1")
     rows = cursor.fetchall()
-    conn.close()
     return [dict(row) for row in rows]
 
 def add_event(name, date, location, price, total_tickets):
     """Adds a new event."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO events (name, date, location, price, total_tickets, is_active) 
-        VALUES (?, ?, ?, ?, ?, 1)
-    ''', (name, date, location, price, total_tickets))
-    conn.commit()
-    conn.close()
+    conn = _conn()
+    with conn:
+        conn.execute('''
+            INSERT INTO events (name, date, location, price, total_tickets, is_active) 
+            VALUES (?, ?, ?, ?, ?, 1)
+        ''', (name, date, location, price, total_tickets))
+    _invalidate_stats()
 
 def get_event_by_id(event_id):
     """Fetches a single event by ID."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM events WHERE id = ?", (event_id,))
     event = cursor.fetchone()
-    conn.close()
     return dict(event) if event else None
 
 def get_tickets_sold(event_id):
     """Counts how many tickets were sold for a specific event."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM tickets WHERE event_id = ?", (event_id,))
     count = cursor.fetchone()[0]
-    conn.close()
     return count
 
+@_cached_stat
 def get_total_revenue():
     """Calculates total revenue from all ticket sales."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT SUM(events.price) 
+        SELECT ROUND(COALESCE(SUM(events.price), 0), 2) 
         FROM tickets 
         JOIN events ON tickets.event_id = events.id
     ''')
-    result = cursor.fetchone()[0]
-    conn.close()
-    return round(result, 2) if result else 0
+    return cursor.fetchone()[0]
 
+@_cached_stat
 def get_total_tickets_sold():
     """Counts total tickets sold across all events."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM tickets")
-    result = cursor.fetchone()[0]
-    conn.close()
-    return result if result else 0
+    return cursor.fetchone()[0]
 
+@_cached_stat
 def get_top_event():
     """Finds the event with the highest sales."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT events.name, COUNT(tickets.id) as ticket_count 
-        FROM tickets 
-        JOIN events ON tickets.event_id = events.id 
-        GROUP BY events.id 
-        ORDER BY ticket_count DESC 
-        LIMIT 1
+        SELECT COALESCE((
+            SELECT events.name 
+            FROM tickets 
+            JOIN events ON tickets.event_id = events.id 
+            GROUP BY events.id 
+            ORDER BY COUNT(tickets.id) DESC 
+            LIMIT 1
+        ), 'No Sales Yet')
     ''')
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else "No Sales Yet"
+    return cursor.fetchone()[0]
 
 def get_user_tickets(user_id):
     """Fetches all tickets for a specific user ID."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = _conn()
     cursor = conn.cursor()
     
     # Query to join ticket data with event details
@@ -153,86 +248,100 @@ def get_user_tickets(user_id):
     """, (user_id,))
     
     rows = cursor.fetchall()
-    conn.close()
     return [dict(row) for row in rows]
 
 def get_events_by_date(target_date):
     # Returns all events happening on a specific date (format: YYYY-MM-DD).
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM events WHERE date = ? AND is_active = 1", (target_date,))
     rows = cursor.fetchall()
-    conn.close()
     return [dict(row) for row in rows]
 
 def get_users_with_tickets_for_event(event_id):
     # Returns a list of user_ids that have a ticket for a specific event.
-    conn = sqlite3.connect(DB_NAME)
+    conn = _conn()
     cursor = conn.cursor()
     cursor.execute("SELECT DISTINCT user_id FROM tickets WHERE event_id = ?", (event_id,))
     rows = cursor.fetchall()
-    conn.close()
     return [row[0] for row in rows]
 
 # --- Pagination, Archive & Export Functions ---
 
-def get_events_paginated(page=1, per_page=5, search_query="", active_status=1):
+def get_events_paginated_with_stats(last_seen_id=None, first_seen_id=None, per_page=5, search_query="", active_status=1):
     """
-    active_status=1 -> fetches active events
-    active_status=0 -> fetches archived events
+    Keyset-paginated events (newest first), each carrying its 'sold' ticket count.
+    last_seen_id  -> the page after the one whose smallest id this is ("Next")
+    first_seen_id -> the page before the one whose largest id this is ("Previous")
+    Neither       -> the first page
+    Returns (events, has_prev, has_next). Each page costs O(per_page), however deep it is.
     """
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = _conn()
     cursor = conn.cursor()
 
-    offset = (page - 1) * per_page
-    
-    if search_query:
-        query = "SELECT * FROM events WHERE is_active = ? AND name LIKE ? ORDER BY id ASC LIMIT ? OFFSET ?"
-        params = (active_status, f"%{search_query}%", per_page, offset)
-        
-        count_query = "SELECT COUNT(*) FROM events WHERE is_active = ? AND name LIKE ?"
-        count_params = (active_status, f"%{search_query}%")
+    going_back = first_seen_id is not None
+    if going_back:
+        id_filter, order, cursor_id = "AND e.id > ?", "ASC", first_seen_id
+    elif last_seen_id is not None:
+        id_filter, order, cursor_id = "AND e.id < ?", "DESC", last_seen_id
     else:
-        query = "SELECT * FROM events WHERE is_active = ? ORDER BY id ASC LIMIT ? OFFSET ?"
-        params = (active_status, per_page, offset)
-        
-        count_query = "SELECT COUNT(*) FROM events WHERE is_active = ?"
-        count_params = (active_status,)
+        id_filter, order, cursor_id = "", "DESC", None
+
+    params = [active_status, f"%{search_query}%"]
+    if cursor_id is not None:
+        params.append(cursor_id)
+    params.append(per_page + 1)  # One extra row tells whether another page exists
 
-    cursor.execute(query, params)
+    # "+e.is_active" keeps SQLite off the is_active index, so it walks the primary key
+    # from the cursor in id order and stops after LIMIT rows (no sort of all matches)
+    cursor.execute(f'''
+        SELECT e.*, COUNT(t.id) AS sold
+        FROM events e
+        LEFT JOIN tickets t ON t.event_id = e.id
+        WHERE +e.is_active = ? AND e.name LIKE ? {id_filter}
+        GROUP BY e.id
+        ORDER BY e.id {order}
+        LIMIT ?
+    ''', params)
     events = [dict(row) for row in cursor.fetchall()]
 
-    cursor.execute(count_query, count_params)
-    total_items = cursor.fetchone()[0]
-    total_pages = (total_items + per_page - 1) // per_page
+    has_more = len(events) > per_page
+    events = events[:per_page]
 
-    conn.close()
-    return events, total_pages
+    if going_back:
+        events.reverse()
+        return events, has_more, True
+    return events, cursor_id is not None, has_more
 
 def archive_event(event_id):
     """Marks an event as archived (inactive)."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE events SET is_active = 0 WHERE id = ?", (event_id,))
-    conn.commit()
-    conn.close()
+    conn = _conn()
+    with conn:
+        conn.execute("UPDATE events SET is_active = 0 WHERE id = ?", (event_id,))
+    _invalidate_stats()
 
 def restore_event(event_id):
     """Restores an archived event (sets is_active = 1)."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE events SET is_active = 1 WHERE id = ?", (event_id,))
-    conn.commit()
-    conn.close()
+    conn = _conn()
+    with conn:
+        conn.execute("UPDATE events SET is_active = 1 WHERE id = ?", (event_id,))
+    _invalidate_stats()
 
-def get_all_events_for_export():
-    """Fetches all events with sales data for CSV export."""
-    conn = sqlite3.connect(DB_NAME)
+def _stream_rows(query):
+    """
+    Yields the query's rows one at a time instead of loading them all.
+    Uses its own connection, since a streamed response may be consumed from other threads.
+    """
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+    try:
+        for row in conn.execute(query):
+            yield dict(row)
+    finally:
+        conn.close()
+
+def get_all_events_for_export():
+    """Yields all events with sales data for CSV export."""
     # Complex query that also fetches sold ticket count and revenue per event
     query = '''
         SELECT 
@@ -246,17 +355,10 @@ def get_all_events_for_export():
         ORDER BY e.date DESC
     '''
     
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    return _stream_rows(query)
 
 def get_all_tickets_for_export():
-    """Fetches all tickets with event details for the Guest List export."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+    """Yields all tickets with event details for the Guest List export."""
     # Query linking ticket to event details
     query = '''
         SELECT 
@@ -271,7 +373,4 @@ def get_all_tickets_for_export():
         ORDER BY t.id DESC
     '''
     
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
\ No newline at end of file
+    return _stream_rows(query)
\ No newline at end of file
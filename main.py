@@ -1,24 +1,30 @@
 import os
 import stripe
 import qrcode 
-import requests
-import secrets
+import qrcode.image.pure
+import hmac
+import hashlib
 import logging
 import aiohttp
 import asyncio
 import csv
+import jinja2
+import json
 from io import StringIO
 from datetime import date
+from typing import Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from itsdangerous import TimestampSigner, BadSignature
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # FastAPI Imports
 from fastapi import FastAPI, HTTPException, Request, Form, Depends, status, BackgroundTasks, Response
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 
 # Core Logic
 from core import db_manager
@@ -36,40 +42,79 @@ logging.basicConfig(
 )
 
 # 3. Initialize App
-app = FastAPI()
+# JSON API responses are serialized with orjson instead of the stdlib json module
+app = FastAPI(default_response_class=ORJSONResponse)
 
-# 4. Security Setup (Cookie Based)
+# 4. Security Setup (Signed Cookie)
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+# The signing key must be shared by every worker and survive restarts, so there is no random fallback:
+# without SESSION_SECRET, logins are refused (like a missing ADMIN_PASSWORD)
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+cookie_signer = TimestampSigner(SESSION_SECRET) if SESSION_SECRET else None
+if not SESSION_SECRET:
+    logging.warning("SESSION_SECRET is not set: admin logins are disabled until it is configured")
+SESSION_MAX_AGE = 60 * 60 * 12  # 12 hours
+
+def check_admin_password(password: str) -> bool:
+    """Constant-time comparison against the configured admin password."""
+    if not ADMIN_PASSWORD:
+        return False
+    return hmac.compare_digest(password.encode(), ADMIN_PASSWORD.encode())
 
 def get_current_username(request: Request):
     """
-    Checks for a valid session cookie.
+    Checks for a valid (signed, not expired) session cookie.
     If not found, redirects the user to the login page.
     """
-    user = request.cookies.get("session_user")
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            headers={"Location": "/login"}
-        )
-    return user
+    cookie = request.cookies.get("session_user")
+    if cookie and cookie_signer:
+        try:
+            return cookie_signer.unsign(cookie, max_age=SESSION_MAX_AGE).decode()
+        except BadSignature:  # Also raised for expired cookies
+            pass
+    raise HTTPException(
+        status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+        headers={"Location": "/login"}
+    )
 
 # 5. Middleware (CORS)
+# Explicit origins (comma-separated in CORS_ORIGINS); preflight answers are cached by the browser for a day
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "http://127.0.0.1:8000").split(",") if o.strip()]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], 
+    allow_origins=CORS_ORIGINS, 
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type"],
+    max_age=86400,
 )
 
 # 6. Third-Party Keys
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
-YOUR_DOMAIN = "[http://127.0.0.1:8000](http://127.0.0.1:8000)"
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_SEND_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+TELEGRAM_SEND_PHOTO_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendPhoto"
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+YOUR_DOMAIN = "http://127.0.0.1:8000"
 
 # 7. Static Files & Templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+class TicketStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers cache ticket QR images for good (a ticket's PNG never changes)."""
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        name = os.path.basename(full_path)
+        if name.startswith("ticket_") and name.endswith(".png"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+app.mount("/static", TicketStaticFiles(directory="static"), name="static")
+# Compiled templates are cached on disk and not re-checked on every render
+os.makedirs(".jinja_cache", exist_ok=True)
+templates = Jinja2Templates(env=jinja2.Environment(
+    loader=jinja2.FileSystemLoader("templates"),
+    auto_reload=False,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(".jinja_cache")
+))
 
 
 # --- Data Models ---
@@ -103,38 +148,53 @@ class ChatRequest(BaseModel):
 class ParseRequest(BaseModel):
     raw_text: str
 
+# Max parallel Telegram requests per broadcast
+BROADCAST_CONCURRENCY = 50
+
+# One keep-alive session for every Telegram API call (opened on startup, closed on shutdown)
+tg_session: Optional[aiohttp.ClientSession] = None
+
+async def send_telegram_message_to_users(user_ids, text):
+    """
+    Sends the same Markdown message to every user in parallel, at most BROADCAST_CONCURRENCY at a time.
+    Returns how many messages Telegram accepted.
+    """
+    # Cap in-flight requests so big sends don't trip Telegram's rate limits
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    # The JSON body is identical for every user except chat_id, so serialize the rest once
+    # (concatenated, not %-formatted: the message itself may contain '%')
+    payload_tail = b',"text":' + json.dumps(text).encode() + b',"parse_mode":"Markdown"}'
+    headers = {"Content-Type": "application/json"}
+
+    async def send(user_id):
+        async with semaphore:
+            try:
+                async with tg_session.post(TELEGRAM_SEND_URL, data=b'{"chat_id":' + str(user_id).encode() + payload_tail, headers=headers) as response:
+                    return response.status == 200
+            except Exception as e:
+                logging.error(f"Telegram message to {user_id} failed: {e}")
+                return False
+    
+    # Count results as they finish instead of waiting for the whole batch
+    success_count = 0
+    for task in asyncio.as_completed([send(user_id) for user_id in user_ids]):
+        if await task:
+            success_count += 1
+    return success_count
+
 async def send_telegram_broadcast_task(user_ids, message, event_name):
     """
     Asynchronous version: Sends messages in parallel (non-blocking).
     """
-    bot_token = os.getenv("TELEGRAM_TOKEN")
-    send_url = f"[https://api.telegram.org/bot](https://api.telegram.org/bot){bot_token}/sendMessage"
-    
     logging.info(f"🚀 Starting FAST broadcast for '{event_name}' to {len(user_ids)} users...")
 
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for user_id in user_ids:
-            full_text = (
-                f"📢 **Update regarding {event_name}**\n\n"
-                f"{message}\n\n"
-                f"-- PartyFlow Management"
-            )
-            
-            payload = {
-                "chat_id": user_id, 
-                "text": full_text, 
-                "parse_mode": "Markdown"
-            }
-            task = session.post(send_url, json=payload)
-            tasks.append(task)
-        
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        success_count = 0
-        for response in responses:
-            if not isinstance(response, Exception) and response.status == 200:
-                success_count += 1
+    full_text = (
+        f"📢 **Update regarding {event_name}**\n\n"
+        f"{message}\n\n"
+        f"-- PartyFlow Management"
+    )
+    success_count = await send_telegram_message_to_users(user_ids, full_text)
                 
     logging.info(f"✅ Fast Broadcast complete! Sent to {success_count}/{len(user_ids)} users.")
 
@@ -167,10 +227,22 @@ async def login(request: Request, username: str = Form(...), password: str = For
             "request": request, 
             "error": "Security Error: No admin password configured in .env"
         })
+    
+    if not cookie_signer:
+        return templates.TemplateResponse("login.html", {
+            "request": request, 
+            "error": "Security Error: No session secret configured in .env"
+        })
 
-    if username == "admin" and password == ADMIN_PASSWORD:
+    if username == "admin" and check_admin_password(password):
         response = RedirectResponse(url="/dashboard", status_code=303)
-        response.set_cookie(key="session_user", value=username)
+        response.set_cookie(
+            key="session_user",
+            value=cookie_signer.sign(username).decode(),
+            max_age=SESSION_MAX_AGE,
+            httponly=True,
+            samesite="lax"
+        )
         return response
     
     return templates.TemplateResponse("login.html", {
@@ -217,55 +289,71 @@ def get_tickets_api(user_id: int):
 
 @app.post("/api/login")
 def login_api(request: LoginRequest):
-    if request.password == ADMIN_PASSWORD:
+    if check_admin_password(request.password):
         return {"success": True, "message": "Login successful"}
     else:
         raise HTTPException(status_code=401, detail="Incorrect password")
 
-@app.post("/api/ask")
-def ask_ai(request: ChatRequest):
-    # Fetch active events from the database
+def build_events_context():
+    """Converts the active events to a simple text format for the AI."""
     events = db_manager.get_events()
     
-    # Convert events to a simple text format for the AI
     events_str = ""
     for e in events:
         events_str += f"- Event: {e['name']}, Date: {e['date']}, Location: {e['location']}, Price: {e['price']}\n"
     
     if not events_str:
         events_str = "No active events at the moment."
+    return events_str
 
+@app.post("/api/ask")
+def ask_ai(request: ChatRequest):
     # Send context and question to AI
-    answer = ai_manager.answer_user_question(request.user_question, events_str)
+    answer = ai_manager.answer_user_question(request.user_question, build_events_context())
     
     return {"answer": answer}
 
+@app.post("/api/ask/stream")
+def ask_ai_stream(request: ChatRequest):
+    """Same as /api/ask, but streams the answer as plain text while the AI writes it."""
+    chunks = ai_manager.stream_user_answer(request.user_question, build_events_context())
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+
 
 # --- Dashboard Routes (Admin) ---
 
 @app.get("/dashboard", response_class=HTMLResponse, dependencies=[Depends(get_current_username)])
-def show_dashboard(request: Request, page: int = 1, q: str = "", view: str = "active"):
+def show_dashboard(
+    request: Request,
+    page: int = 1,
+    q: str = "",
+    view: str = "active",
+    last_seen_id: Optional[int] = None,
+    first_seen_id: Optional[int] = None
+):
     """
     view='active' -> standard view
     view='archived' -> archive view
+    last_seen_id / first_seen_id -> keyset cursors for the Next / Previous page
+    (page is only the number shown to the user)
     """
     
     # Set fetch status (1=active, 0=archived)
     is_active_status = 0 if view == 'archived' else 1
     
-    raw_events, total_pages = db_manager.get_events_paginated(
-        page=page, 
+    # Events come back with their sold count already joined in
+    raw_events, has_prev, has_next = db_manager.get_events_paginated_with_stats(
+        last_seen_id=last_seen_id,
+        first_seen_id=first_seen_id,
         per_page=5, 
         search_query=q,
         active_status=is_active_status
     )
     
     events_processed = []
-    for event in raw_events:
-        e_dict = dict(event)
-        sold = db_manager.get_tickets_sold(e_dict['id'])
+    for e_dict in raw_events:
+        sold = e_dict['sold']
         total = e_dict['total_tickets']
-        e_dict['sold'] = sold
         e_dict['remaining'] = total - sold
         e_dict['percent'] = int((sold / total) * 100) if total > 0 else 0
         events_processed.append(e_dict)
@@ -281,7 +369,8 @@ def show_dashboard(request: Request, page: int = 1, q: str = "", view: str = "ac
         "events": events_processed,  
         "stats": stats,
         "current_page": page,
-        "total_pages": total_pages,
+        "has_prev": has_prev,
+        "has_next": has_next,
         "search_query": q,
         "view_mode": view 
     })
@@ -345,19 +434,15 @@ def restore_event_route(event_id: int):
 
 @app.get("/dashboard/export_csv", dependencies=[Depends(get_current_username)])
 def export_events_csv():
-    # 1. Fetch data
+    # 1. Fetch data (rows are streamed from the database, not loaded at once)
     events = db_manager.get_all_events_for_export()
     
-    # 2. Create CSV in memory
-    output = StringIO()
-    writer = csv.writer(output)
-    
     # Column headers
-    writer.writerow(['ID', 'Event Name', 'Date', 'Location', 'Price (NIS)', 'Capacity', 'Tickets Sold', 'Revenue'])
+    header = ['ID', 'Event Name', 'Date', 'Location', 'Price (NIS)', 'Capacity', 'Tickets Sold', 'Revenue']
     
-    # Write rows
-    for e in events:
-        writer.writerow([
+    # 2. Map rows to CSV columns
+    rows = (
+        [
             e['id'], 
             e['name'], 
             e['date'], 
@@ -366,49 +451,43 @@ def export_events_csv():
             e['total_tickets'], 
             e['sold_count'], 
             e['revenue']
-        ])
-        
-    # 3. Prepare download
-    output.seek(0)
+        ]
+        for e in events
+    )
     
+    # 3. Stream the download as it is written
     return StreamingResponse(
-        iter([output.getvalue()]),
+        stream_csv(header, rows),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=partyflow_report.csv"}
     )
 
 @app.get("/dashboard/export_tickets", dependencies=[Depends(get_current_username)])
 def export_tickets_csv():
-    # 1. Fetch all tickets
+    # 1. Fetch all tickets (streamed from the database)
     tickets = db_manager.get_all_tickets_for_export()
     
-    # 2. Create CSV in memory
-    output = StringIO()
-    writer = csv.writer(output)
-    
     # Headers (Matches QR data)
-    writer.writerow(['Ticket ID', 'Event Name', 'Owner Name', 'Phone', 'Purchase Time', 'Telegram ID', 'QR String'])
+    header = ['Ticket ID', 'Event Name', 'Owner Name', 'Phone', 'Purchase Time', 'Telegram ID', 'QR String']
     
-    # Write rows
-    for t in tickets:
-        # Generate QR string (for manual verification)
-        qr_string = f"TICKET-ID:{t['ticket_id']} | EVENT:{t['event_name']} | OWNER:{t['telegram_id']}"
-        
-        writer.writerow([
+    # 2. Map rows to CSV columns
+    rows = (
+        [
             t['ticket_id'], 
             t['event_name'], 
             t['user_name'], 
             t['phone_number'], 
             t['purchase_time'],
             t['telegram_id'],
-            qr_string
-        ])
-        
-    # 3. Prepare download
-    output.seek(0)
+            # QR string (for manual verification)
+            f"TICKET-ID:{t['ticket_id']} | EVENT:{t['event_name']} | OWNER:{t['telegram_id']}"
+        ]
+        for t in tickets
+    )
     
+    # 3. Stream the download as it is written
     return StreamingResponse(
-        iter([output.getvalue()]),
+        stream_csv(header, rows),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=guest_list.csv"}
     )
@@ -456,41 +535,56 @@ def create_checkout_session(ticket: TicketRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/payment_success", response_class=HTMLResponse)
-def payment_success(session_id: str, request: Request):
+def payment_success(request: Request):
+    # Tickets are issued by the Stripe webhook; the redirect back only shows the page
+    return templates.TemplateResponse("success.html", {"request": request})
+
+@app.post("/webhooks/stripe")
+async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Stripe calls this when a checkout completes: saves the order's tickets and queues their delivery."""
+    if not STRIPE_WEBHOOK_SECRET:
+        logging.error("Stripe webhook rejected: STRIPE_WEBHOOK_SECRET is not set")
+        raise HTTPException(status_code=500, detail="Webhook not configured")
+    
+    payload = await request.body()
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        if session.payment_status == 'paid':
-            data = session.metadata
-            quantity = int(data.get('quantity', 1)) # Default to 1 if missing
-            
-            event = db_manager.get_event_by_id(int(data['event_id']))
-            
-            # Loop to create multiple tickets
-            for i in range(quantity):
-                ticket_id = db_manager.add_ticket(
-                    event_id=int(data['event_id']),
-                    user_id=int(data['user_id']),
-                    user_name=data['user_name'],
-                    phone_number=data['phone_number']
-                )
-                
-                qr_path = generate_qr_code(ticket_id, event['name'], data['user_name'])
-                
-                caption = (
-                    f"🎉 Ticket {i+1}/{quantity} Confirmed!\n"
-                    f"Event: {event['name']}\n"
-                    f"Ticket ID: #{ticket_id}\n\n"
-                    f"Show this QR code at the entrance."
-                )
-                # Send individual QR to user
-                send_ticket_to_telegram(data['user_id'], qr_path, caption)
-            
-            return templates.TemplateResponse("success.html", {"request": request})
-        else:
-            return "Payment Failed or Pending."
-    except Exception as e:
-        logging.error(f"Payment processing error: {e}")
-        return f"Error processing payment: {e}"
+        stripe_event = stripe.Webhook.construct_event(
+            payload, request.headers.get("stripe-signature"), STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        logging.error(f"Stripe webhook rejected: {e}")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
+    
+    if stripe_event["type"] != "checkout.session.completed":
+        return {"received": True}
+    
+    session = stripe_event["data"]["object"]
+    if session["payment_status"] != "paid":
+        return {"received": True}
+    
+    data = session["metadata"]
+    quantity = int(data.get("quantity", 1))  # Default to 1 if missing
+    # SQLite calls run in the threadpool so the write transaction never blocks the event loop
+    event = await run_in_threadpool(db_manager.get_event_by_id, int(data['event_id']))
+    if not event:
+        # Acknowledged so Stripe stops retrying; a paid order for a missing event needs manual handling
+        logging.error(f"Stripe webhook: event #{data['event_id']} not found for paid session {session['id']}")
+        return {"received": True}
+    
+    # Insert all tickets of the order in a single transaction (a repeated delivery of the same session adds nothing)
+    row = (int(data['event_id']), int(data['user_id']), data['user_name'], data['phone_number'])
+    ticket_ids = await run_in_threadpool(db_manager.add_tickets_bulk, [row] * quantity, payment_id=session["id"])
+    if ticket_ids is False:
+        # Non-2xx makes Stripe retry the event later
+        raise HTTPException(status_code=500, detail="Error saving tickets")
+    
+    for i, ticket_id in enumerate(ticket_ids):
+        # QR + Telegram delivery run after Stripe has been answered
+        background_tasks.add_task(
+            generate_and_send, ticket_id, event['name'], data['user_id'], data['user_name'], i, quantity
+        )
+    
+    return {"received": True}
 
 @app.get("/payment_cancel")
 def payment_cancel():
@@ -501,7 +595,7 @@ def payment_cancel():
 
 scheduler = AsyncIOScheduler()
 
-def check_and_send_reminders():
+async def check_and_send_reminders():
     today = date.today().isoformat()
     logging.info(f"Scheduler running: checking for events on {today}")
 
@@ -510,26 +604,25 @@ def check_and_send_reminders():
         logging.info("No events today.")
         return
     
-    token = os.getenv("TELEGRAM_TOKEN")
     for event in events:
         logging.info(f"Found event: {event['name']}! Sending reminders...")
         user_ids = db_manager.get_users_with_tickets_for_event(event["id"])
 
-        for user_id in user_ids:
-            try:
-                msg = (
-                    f"Today is the day!\n\n"
-                    f"Get ready! **{event['name']}** is happening today.\n"
-                    f"Location: {event['location']}\n\n"
-                    f"See you there!"
-                )
-                requests.post(f"[https://api.telegram.org/bot](https://api.telegram.org/bot){token}/sendMessage", json={
-                    "chat_id": user_id, 
-                    "text": msg, 
-                    "parse_mode": "Markdown"
-                })
-            except Exception as e:
-                logging.error(f"Failed to send reminder to {user_id}: {e}")
+        msg = (
+            f"Today is the day!\n\n"
+            f"Get ready! **{event['name']}** is happening today.\n"
+            f"Location: {event['location']}\n\n"
+            f"See you there!"
+        )
+        
+        # Same bounded parallel send as the broadcast
+        sent = await send_telegram_message_to_users(user_ids, msg)
+        logging.info(f"Reminders for {event['name']}: sent to {sent}/{len(user_ids)} users.")
+
+@app.on_event("startup")
+def init_database():
+    # Idempotent: brings an existing database up to date (e.g. the payments table)
+    db_manager.create_tables()
 
 @app.on_event("startup")
 def start_scheduler():
@@ -537,20 +630,100 @@ def start_scheduler():
     scheduler.start()
     logging.info("✅ Scheduler started")
 
+@app.on_event("startup")
+async def open_telegram_session():
+    global tg_session
+    # Pooled keep-alive connections: no new TCP+TLS handshake per Telegram message.
+    # Timeouts apply per socket, not in total: a request queued behind a busy pool
+    # (broadcast + reminders + ticket photos at once) must not time out just for waiting
+    tg_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=BROADCAST_CONCURRENCY, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=10)
+    )
+
+@app.on_event("shutdown")
+async def close_telegram_session():
+    if tg_session:
+        await tg_session.close()
+
+@app.on_event("shutdown")
+def close_database():
+    db_manager.close_connections()
+
 
 # --- Helpers ---
 
 def generate_qr_code(ticket_id: int, event_name: str, user_name: str):
+    data = f"TICKET-ID:{ticket_id} | EVENT:{event_name} | OWNER:{user_name}"
+    
+    # The file name carries a digest of the QR content, so an existing file is
+    # reused only if it encodes exactly this ticket (never a stale one with the same ID)
+    digest = hashlib.sha1(data.encode()).hexdigest()[:12]
+    file_path = f"static/ticket_{ticket_id}_{digest}.png"
+    if os.path.exists(file_path):
+        return file_path
+    
     if not os.path.exists("static"):
         os.makedirs("static")
-    data = f"TICKET-ID:{ticket_id} | EVENT:{event_name} | OWNER:{user_name}"
-    qr = qrcode.make(data)
-    file_path = f"static/ticket_{ticket_id}.png"
-    qr.save(file_path)
+    
+    # PyPNG writer (no Pillow image) + low error correction and small boxes -> faster, smaller PNG
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=4,
+        border=2,
+        image_factory=qrcode.image.pure.PyPNGImage
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    # Write to a temp file first so a crash never leaves a half-written PNG behind
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        qr.make_image().save(f)
+    os.replace(tmp_path, file_path)
     return file_path
 
-def send_ticket_to_telegram(chat_id, file_path, caption):
-    bot_token = os.getenv("TELEGRAM_TOKEN")
-    url = f"[https://api.telegram.org/bot](https://api.telegram.org/bot){bot_token}/sendPhoto"
+async def send_ticket_to_telegram(chat_id, file_path, caption):
     with open(file_path, "rb") as image_file:
-        requests.post(url, data={"chat_id": chat_id, "caption": caption}, files={"photo": image_file})
\ No newline at end of file
+        form = aiohttp.FormData()
+        form.add_field("chat_id", str(chat_id))
+        form.add_field("caption", caption)
+        form.add_field("photo", image_file, filename=os.path.basename(file_path))
+        async with tg_session.post(TELEGRAM_SEND_PHOTO_URL, data=form) as response:
+            if response.status != 200:
+                logging.error(f"Failed to send ticket to {chat_id}: HTTP {response.status}")
+
+async def generate_and_send(ticket_id, event_name, chat_id, user_name, index, quantity):
+    """Background task: renders a ticket's QR code and sends it to the buyer on Telegram."""
+    try:
+        qr_path = await asyncio.to_thread(generate_qr_code, ticket_id, event_name, user_name)
+        
+        caption = (
+            f"🎉 Ticket {index+1}/{quantity} Confirmed!\n"
+            f"Event: {event_name}\n"
+            f"Ticket ID: #{ticket_id}\n\n"
+            f"Show this QR code at the entrance."
+        )
+        # Send individual QR to user
+        await send_ticket_to_telegram(chat_id, qr_path, caption)
+    except Exception as e:
+        logging.error(f"Ticket delivery error (ticket #{ticket_id}): {e}")
+
+def stream_csv(header, rows, chunk_size=64 * 1024):
+    """
+    Writes CSV rows into a small reusable buffer and yields it in ~64KB chunks,
+    so memory stays flat no matter how many rows are exported.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate(0)
+    
+    yield buffer.getvalue().encode()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the app modules (main, core.*) from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# main.py mounts "static" and loads "templates" relative to the working directory
+os.chdir(ROOT)
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from itsdangerous import TimestampSigner
+
+import main
+
+
+def login(client):
+    return client.post("/login", data={"username": "admin", "password": "secret"}, follow_redirects=False)
+
+
+def test_login_is_refused_without_session_secret(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_PASSWORD", "secret")
+    monkeypatch.setattr(main, "cookie_signer", None)
+    client = TestClient(main.app)
+
+    response = login(client)
+
+    assert response.status_code == 200
+    assert "No session secret configured" in response.text
+    assert "session_user" not in response.cookies
+
+
+def test_cookie_signed_with_shared_secret_is_accepted(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_PASSWORD", "secret")
+    monkeypatch.setattr(main, "cookie_signer", TimestampSigner("shared-secret"))
+    client = TestClient(main.app)
+    cookie = login(client).cookies["session_user"]
+
+    # Another worker builds its own signer from the same SESSION_SECRET
+    monkeypatch.setattr(main, "cookie_signer", TimestampSigner("shared-secret"))
+    assert main.get_current_username(SimpleNamespace(cookies={"session_user": cookie})) == "admin"
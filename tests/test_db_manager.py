@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from core import db_manager
+
+
+def test_worker_thread_reconnects_after_close_connections(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_manager, "DB_NAME", str(tmp_path / "party_bot.db"))
+    db_manager.close_connections()  # Start from fresh connections on the temporary database
+    db_manager.create_tables()
+    db_manager.add_event("Opening Night", "2025-01-01", "Tel Aviv", 50.0, 100)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert len(pool.submit(db_manager.get_events).result()) == 1
+        db_manager.close_connections()
+        # The same worker thread must open a new connection instead of reusing the closed one
+        assert len(pool.submit(db_manager.get_events).result()) == 1
+
+    db_manager.close_connections()
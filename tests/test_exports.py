@@ -0,0 +1,53 @@
+import csv
+from io import StringIO
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from core import db_manager
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Logged-in test client with the export queries stubbed out."""
+    monkeypatch.setattr(db_manager, "get_all_events_for_export", lambda: iter([
+        {"id": 1, "name": "Opening Night", "date": "2025-01-01", "location": "Tel Aviv",
+         "price": 50.0, "total_tickets": 100, "sold_count": 2, "revenue": 100.0},
+    ]))
+    monkeypatch.setattr(db_manager, "get_all_tickets_for_export", lambda: iter([
+        {"ticket_id": 7, "event_name": "Opening Night", "user_name": "Dana", "phone_number": "050",
+         "purchase_time": "2025-01-01 10:00:00", "telegram_id": 42},
+    ]))
+    main.app.dependency_overrides[main.get_current_username] = lambda: "admin"
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def read_csv(text):
+    return list(csv.reader(StringIO(text)))
+
+
+def test_export_events_csv(client):
+    response = client.get("/dashboard/export_csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = read_csv(response.text)
+    assert rows[0][0] == "ID"
+    assert rows[1][:2] == ["1", "Opening Night"]
+
+
+def test_export_tickets_csv(client):
+    response = client.get("/dashboard/export_tickets")
+    assert response.status_code == 200
+    rows = read_csv(response.text)
+    assert rows[0][0] == "Ticket ID"
+    assert rows[1][0] == "7"
+    assert rows[1][-1] == "TICKET-ID:7 | EVENT:Opening Night | OWNER:42"
+
+
+def test_stream_csv_chunks():
+    rows = ([i, "x" * 100] for i in range(2000))
+    chunks = list(main.stream_csv(["n", "text"], rows, chunk_size=1024))
+    assert len(chunks) > 1
+    assert len(read_csv(b"".join(chunks).decode())) == 2001
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from core import db_manager
+
+SECRET = "whsec_test"
+
+
+def signed_post(client, event):
+    """Posts an event to the webhook with a valid Stripe-Signature header."""
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return client.post(
+        "/webhooks/stripe",
+        content=payload,
+        headers={"Stripe-Signature": f"t={timestamp},v1={signature}", "Content-Type": "application/json"},
+    )
+
+
+def checkout_completed(event_id=1, quantity=2):
+    return {
+        "id": "evt_1",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": "cs_1",
+            "object": "checkout.session",
+            "payment_status": "paid",
+            "metadata": {
+                "event_id": str(event_id), "user_id": "42", "user_name": "Dana",
+                "phone_number": "050", "quantity": str(quantity),
+            },
+        }},
+    }
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    """Records add_tickets_bulk calls instead of writing to the database."""
+    calls = []
+
+    def add_tickets_bulk(rows, payment_id=None):
+        calls.append((rows, payment_id))
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()  # Must run in the threadpool, not on the event loop
+        return [10 + i for i in range(len(rows))]
+
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(db_manager, "add_tickets_bulk", add_tickets_bulk)
+    monkeypatch.setattr(main, "generate_and_send", lambda *args: None)
+    return calls
+
+
+def test_paid_checkout_issues_tickets(monkeypatch, inserted):
+    monkeypatch.setattr(db_manager, "get_event_by_id", lambda event_id: {"id": event_id, "name": "Opening Night"})
+    response = signed_post(TestClient(main.app), checkout_completed(quantity=2))
+    assert response.status_code == 200
+    assert len(inserted) == 1
+    rows, payment_id = inserted[0]
+    assert rows == [(1, 42, "Dana", "050")] * 2
+    assert payment_id == "cs_1"
+
+
+def test_unknown_event_is_acknowledged_without_saving(monkeypatch, inserted):
+    monkeypatch.setattr(db_manager, "get_event_by_id", lambda event_id: None)
+    response = signed_post(TestClient(main.app), checkout_completed(event_id=999))
+    assert response.status_code == 200
+    assert inserted == []
+
+
+def test_bad_signature_is_rejected(inserted):
+    response = TestClient(main.app).post(
+        "/webhooks/stripe", content=b"{}", headers={"Stripe-Signature": "t=1,v1=bad"}
+    )
+    assert response.status_code == 400
+    assert inserted == []
+
+
+def test_missing_secret_is_rejected(monkeypatch):
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", None)
+    response = TestClient(main.app).post("/webhooks/stripe", content=b"{}", headers={"Stripe-Signature": "t=1,v1=x"})
+    assert response.status_code == 500
+
+
+def test_missing_quantity_defaults_to_one_ticket(monkeypatch, inserted):
+    monkeypatch.setattr(db_manager, "get_event_by_id", lambda event_id: {"id": event_id, "name": "Opening Night"})
+    event = checkout_completed()
+    del event["data"]["object"]["metadata"]["quantity"]
+    response = signed_post(TestClient(main.app), event)
+    assert response.status_code == 200
+    assert inserted[0][0] == [(1, 42, "Dana", "050")]
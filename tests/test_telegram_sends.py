@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import main
+from core import db_manager
+
+
+class FakeSession:
+    """Stands in for tg_session: records posted bodies and the peak number of requests in flight."""
+
+    def __init__(self):
+        self.bodies = []
+        self.in_flight = 0
+        self.peak = 0
+
+    def post(self, url, data=None, headers=None):
+        session = self
+
+        class Response:
+            status = 200
+
+            async def __aenter__(self):
+                session.in_flight += 1
+                session.peak = max(session.peak, session.in_flight)
+                await asyncio.sleep(0.01)
+                session.bodies.append(json.loads(data))
+                return self
+
+            async def __aexit__(self, *exc):
+                session.in_flight -= 1
+
+        return Response()
+
+
+def test_reminders_are_sent_through_the_bounded_helper(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(main, "tg_session", session)
+    monkeypatch.setattr(main, "BROADCAST_CONCURRENCY", 3)
+    monkeypatch.setattr(db_manager, "get_events_by_date", lambda day: [
+        {"id": 1, "name": "Opening Night", "location": "Tel Aviv"},
+    ])
+    monkeypatch.setattr(db_manager, "get_users_with_tickets_for_event", lambda event_id: list(range(1, 11)))
+
+    asyncio.run(main.check_and_send_reminders())
+
+    assert sorted(body["chat_id"] for body in session.bodies) == list(range(1, 11))
+    assert all("Opening Night" in body["text"] for body in session.bodies)
+    assert session.peak == 3
+
+
+def test_broadcast_text_may_contain_percent_signs(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(main, "tg_session", session)
+
+    asyncio.run(main.send_telegram_broadcast_task([7], "50% off tonight", "Opening Night"))
+
+    assert session.bodies[0]["chat_id"] == 7
+    assert "50% off tonight" in session.bodies[0]["text"]
+    assert session.bodies[0]["parse_mode"] == "Markdown"
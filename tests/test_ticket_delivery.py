@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from core import db_manager
+
+
+@pytest.fixture
+def deliveries(monkeypatch):
+    """Records queued generate_and_send calls; fails if a QR is rendered inside the request."""
+    queued = []
+
+    async def generate_and_send(*args):
+        queued.append(args)
+
+    def generate_qr_code(*args):
+        raise AssertionError("QR rendered inline instead of in the background task")
+
+    monkeypatch.setattr(main, "generate_and_send", generate_and_send)
+    monkeypatch.setattr(main, "generate_qr_code", generate_qr_code)
+    monkeypatch.setattr(db_manager, "get_event_by_id", lambda event_id: {"id": event_id, "name": "Opening Night"})
+    monkeypatch.setattr(db_manager, "add_tickets_bulk", lambda rows, payment_id=None: [10, 11])
+    return queued
+
+
+def test_paid_checkout_queues_one_delivery_per_ticket(monkeypatch, deliveries):
+    stripe_event = {"type": "checkout.session.completed", "data": {"object": {
+        "id": "cs_1",
+        "payment_status": "paid",
+        "metadata": {"event_id": "1", "user_id": "42", "user_name": "Dana", "phone_number": "050", "quantity": "2"},
+    }}}
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", "whsec_test")
+    monkeypatch.setattr(main.stripe.Webhook, "construct_event", lambda payload, signature, secret: stripe_event)
+
+    response = TestClient(main.app).post("/webhooks/stripe", content=b"{}", headers={"Stripe-Signature": "t=1,v1=x"})
+
+    assert response.status_code == 200
+    assert deliveries == [
+        (10, "Opening Night", "42", "Dana", 0, 2),
+        (11, "Opening Night", "42", "Dana", 1, 2),
+    ]